@@ -0,0 +1,235 @@
+import os
+import re
+import json
+import time
+import fcntl
+import threading
+import tempfile
+from contextlib import contextmanager
+from typing import Optional, Dict, List
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+TEMP_DIR = 'temp'
+ARTIFACT_INDEX_FILE = os.path.join(TEMP_DIR, 'artifact_index.json')
+ARTIFACT_LOCK_FILE = os.path.join(TEMP_DIR, 'artifact_index.lock')
+# One '<job>.<pid>.pin' file per job and worker process holding it
+PIN_DIR = os.path.join(TEMP_DIR, 'pins')
+
+# Disk budget for everything under temp/, in megabytes
+DISK_BUDGET_MB = float(os.getenv('TEMP_DISK_BUDGET_MB', '10240'))
+
+# Transcripts (and the audio fingerprints that find them) are small and expensive to
+# recreate, media is large and can be downloaded again
+TRANSCRIPT_EXTENSIONS = ('.json', '.srt', '.npy')
+
+# Files and directories that belong to the managers themselves and are never evicted
+INTERNAL_FILES = (
+    'artifact_index.json', 'artifact_index.lock', 'transcript_cache.json',
+    'router_latency.json', 'router_latency.json.lock',
+)
+INTERNAL_DIRS = ('pins', 'rate_limits')
+
+# Patterns used to recover the job hash of files created before the index existed
+JOB_PATTERNS = [
+    re.compile(r'^(?:azure_)?(?:original|output)_([0-9a-f]{32})\.'),
+    re.compile(r'^([0-9a-f]{32})[_.]'),
+]
+
+_lock = threading.Lock()
+# Pins held by this process, counted so nested pins of the same job work
+_own_pins: Dict[str, int] = {}
+
+def _artifact_kind(path: str) -> str:
+    return 'transcript' if path.endswith(TRANSCRIPT_EXTENSIONS) else 'media'
+
+def _job_from_name(file_name: str) -> Optional[str]:
+    for pattern in JOB_PATTERNS:
+        match = pattern.match(file_name)
+        if match:
+            return match.group(1)
+    return None
+
+@contextmanager
+def _locked_index():
+    """Load the index from disk under a lock shared by all worker processes
+
+    Every operation re-reads the file, so entries written by other workers
+    are never lost. The index is written back when the block ends.
+    """
+    os.makedirs(TEMP_DIR, exist_ok=True)
+    with _lock, open(ARTIFACT_LOCK_FILE, 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            if os.path.exists(ARTIFACT_INDEX_FILE):
+                with open(ARTIFACT_INDEX_FILE, 'r', encoding='utf-8') as f:
+                    index = json.load(f)
+            else:
+                index = {}
+                _scan_temp_dir(index)
+            yield index
+            _save_index(index)
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def _save_index(index: Dict[str, Dict]) -> None:
+    # Write to a temp file and rename so a crash never leaves a partial index
+    fd, tmp_path = tempfile.mkstemp(dir=TEMP_DIR, suffix='.tmp')
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        json.dump(index, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, ARTIFACT_INDEX_FILE)
+
+def _scan_temp_dir(index: Dict[str, Dict]) -> None:
+    """Adopt files already in temp/ and its subdirectories that are not in the index yet"""
+    for dir_path, dir_names, file_names in os.walk(TEMP_DIR):
+        if dir_path == TEMP_DIR:
+            dir_names[:] = [name for name in dir_names if name not in INTERNAL_DIRS]
+        for file_name in file_names:
+            if file_name in INTERNAL_FILES or file_name.endswith('.tmp'):
+                continue
+            path = os.path.join(dir_path, file_name)
+            if path in index:
+                continue
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            index[path] = {
+                'job': _job_from_name(file_name),
+                'kind': _artifact_kind(path),
+                'size': stat.st_size,
+                'last_access': stat.st_mtime,
+            }
+
+def register_artifact(path: Optional[str], job: str) -> Optional[str]:
+    """Record a file produced or reused by a job and mark it as just accessed"""
+    if not path or not os.path.exists(path):
+        return path
+    with _locked_index() as index:
+        index[path] = {
+            'job': job,
+            'kind': _artifact_kind(path),
+            'size': os.path.getsize(path),
+            'last_access': time.time(),
+        }
+    return path
+
+def forget_artifact(path: str) -> None:
+    """Drop a file from the index, e.g. after the caller deleted it"""
+    with _locked_index() as index:
+        index.pop(path, None)
+
+def _pin_file(job: str) -> str:
+    return os.path.join(PIN_DIR, f'{job}.{os.getpid()}.pin')
+
+def _process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def get_pinned_jobs() -> List[str]:
+    """Return the jobs pinned by any live worker process, removing pins of dead ones"""
+    if not os.path.isdir(PIN_DIR):
+        return []
+    jobs = set()
+    for file_name in os.listdir(PIN_DIR):
+        # Skip anything that is not a pin file, e.g. .DS_Store
+        parts = file_name.rsplit('.', 2)
+        if len(parts) != 3 or not parts[0] or not parts[1].isdigit() or parts[2] != 'pin':
+            continue
+        job, pid = parts[0], int(parts[1])
+        if _process_alive(pid):
+            jobs.add(job)
+        else:
+            try:
+                os.remove(os.path.join(PIN_DIR, file_name))
+            except FileNotFoundError:
+                pass
+    return sorted(jobs)
+
+def pin_job(job: str) -> None:
+    """Protect all files of a job from eviction, across worker processes"""
+    with _lock:
+        if not _own_pins.get(job):
+            os.makedirs(PIN_DIR, exist_ok=True)
+            with open(_pin_file(job), 'w'):
+                pass
+        _own_pins[job] = _own_pins.get(job, 0) + 1
+
+def unpin_job(job: str) -> None:
+    with _lock:
+        if _own_pins.get(job, 0) <= 1:
+            _own_pins.pop(job, None)
+            try:
+                os.remove(_pin_file(job))
+            except FileNotFoundError:
+                pass
+        else:
+            _own_pins[job] -= 1
+
+@contextmanager
+def pinned(job: str):
+    """Keep the files of an in-flight job while the block runs"""
+    pin_job(job)
+    try:
+        yield
+    finally:
+        unpin_job(job)
+
+def get_usage_report() -> Dict:
+    """Summarize disk usage from the index, without walking the directory"""
+    report = {
+        'budget_bytes': int(DISK_BUDGET_MB * 1024 * 1024),
+        'total_bytes': 0,
+        'by_kind': {},
+        'by_job': {},
+        'pinned_jobs': get_pinned_jobs(),
+    }
+    with _locked_index() as index:
+        for record in index.values():
+            report['total_bytes'] += record['size']
+            report['by_kind'][record['kind']] = report['by_kind'].get(record['kind'], 0) + record['size']
+            job = record['job'] or 'unknown'
+            report['by_job'][job] = report['by_job'].get(job, 0) + record['size']
+    return report
+
+def evict_to_budget(budget_mb: Optional[float] = None) -> List[str]:
+    """Delete least recently used artifacts until temp/ fits the disk budget
+
+    Media files go first, transcripts are only evicted if media alone is not
+    enough. Files of jobs pinned by any worker are never touched. Files that
+    were never registered are adopted first, so they can be evicted too.
+    Returns the deleted paths.
+    """
+    budget_bytes = (DISK_BUDGET_MB if budget_mb is None else budget_mb) * 1024 * 1024
+    evicted = []
+    with _locked_index() as index:
+        _scan_temp_dir(index)
+        total_bytes = sum(record['size'] for record in index.values())
+        if total_bytes > budget_bytes:
+            pinned_jobs = set(get_pinned_jobs())
+            candidates = sorted(
+                (path for path, record in index.items() if record['job'] not in pinned_jobs),
+                key=lambda path: (index[path]['kind'] != 'media', index[path]['last_access'])
+            )
+            for path in candidates:
+                if total_bytes <= budget_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    print(f"Error evicting artifact {path}: {str(e)}")
+                    continue
+                total_bytes -= index.pop(path)['size']
+                evicted.append(path)
+    for path in evicted:
+        print(f"Evicted artifact: {path}")
+    return evicted
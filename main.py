@@ -1,4 +1,4 @@
-from aliyunSenseVoice import process_youtube_video
+from transcriptionRouter import process_youtube_video
 
 def main():
     print("Welcome to YouTube Video Processor!")
@@ -0,0 +1,305 @@
+import os
+import json
+import time
+import fcntl
+import random
+import threading
+from contextlib import contextmanager
+from typing import Optional, Dict, Tuple, Callable, Any
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Default limits per (provider, api): requests per second, burst size, max in-flight calls.
+# Rates are set a little under the provider quotas so a full batch stays below them.
+# Each can be overridden with RATE_LIMIT_<PROVIDER>_<API>_RATE, _BURST and _CONCURRENCY.
+#
+# Rate and burst are shared by all worker processes through a token bucket state
+# file per API, so they hold for the whole deployment. max_concurrency and the
+# circuit breakers are per process.
+DEFAULT_LIMITS: Dict[Tuple[str, str], Dict[str, float]] = {
+    ('dashscope', 'transcription'): {'rate': 0.8, 'burst': 2, 'max_concurrency': 4},
+    ('dashscope', 'fetch'): {'rate': 4.0, 'burst': 4, 'max_concurrency': 8},
+    ('dashscope', 'transcript_download'): {'rate': 8.0, 'burst': 8, 'max_concurrency': 8},
+    ('oss', 'meta'): {'rate': 40.0, 'burst': 40, 'max_concurrency': 16},
+    ('oss', 'upload'): {'rate': 8.0, 'burst': 8, 'max_concurrency': 4},
+    ('azure', 'speech'): {'rate': 0.5, 'burst': 1, 'max_concurrency': 2},
+}
+FALLBACK_LIMIT = {'rate': 1.0, 'burst': 1, 'max_concurrency': 1}
+LIMIT_ENV_SUFFIXES = {'rate': 'RATE', 'burst': 'BURST', 'max_concurrency': 'CONCURRENCY'}
+
+# One '<provider>_<api>.json' token bucket state file per API, locked while in use
+RATE_LIMIT_STATE_DIR = os.path.join('temp', 'rate_limits')
+
+# Retry and circuit breaker defaults
+MAX_RETRIES = 5
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+BREAKER_FAILURE_THRESHOLD = 5
+BREAKER_RESET_TIMEOUT = 30.0
+BREAKER_POLL_INTERVAL = 1.0
+
+# Status codes and error codes that mean "slow down" or "try again later"
+THROTTLING_STATUS_CODES = {429}
+TRANSIENT_STATUS_CODES = {500, 502, 503, 504}
+THROTTLING_ERROR_CODES = ('throttl', 'toomanyrequests', 'ratequota', 'qpslimit', 'slowdown')
+
+class ProviderError(Exception):
+    """Error returned by a provider API, carrying its status and error code"""
+    def __init__(self, message: str, status_code: Optional[int] = None, code: Optional[str] = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.code = code
+
+class CircuitOpenError(Exception):
+    """Raised when calls to a provider are short-circuited by its breaker"""
+
+class TokenBucket:
+    """Token bucket allowing `rate` calls per second with bursts of `burst`
+
+    With a `state_file`, the bucket is shared by every process using that
+    file: its state is re-read and written back under a file lock on each
+    operation, and times are wall clock so they mean the same in all processes.
+    """
+    def __init__(self, rate: float, burst: float, state_file: Optional[str] = None):
+        self.rate = rate
+        self.burst = burst
+        self.state_file = state_file
+        self.tokens = burst
+        # Tokens accrue from this moment on; it lies in the future while the bucket is paused
+        self.updated_at = time.time()
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def _locked_state(self):
+        with self.lock:
+            if not self.state_file:
+                yield
+                return
+            os.makedirs(os.path.dirname(self.state_file), exist_ok=True)
+            with open(self.state_file, 'a+', encoding='utf-8') as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    f.seek(0)
+                    data = f.read()
+                    if data:
+                        state = json.loads(data)
+                        self.tokens = min(self.burst, state['tokens'])
+                        self.updated_at = state['updated_at']
+                    yield
+                    f.seek(0)
+                    f.truncate()
+                    json.dump({'tokens': self.tokens, 'updated_at': self.updated_at}, f)
+                    f.flush()
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _refill(self, now: float) -> None:
+        if now <= self.updated_at:
+            return
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def acquire(self) -> None:
+        """Block until a token is available and take it"""
+        while True:
+            with self._locked_state():
+                now = time.time()
+                self._refill(now)
+                if self.tokens >= 1 and now >= self.updated_at:
+                    self.tokens -= 1
+                    return
+                wait_time = max(0.0, self.updated_at - now) + max(0.0, 1 - self.tokens) / self.rate
+            time.sleep(wait_time)
+
+    def pause(self, seconds: float) -> None:
+        """Empty the bucket and hold every caller back for `seconds`, e.g. after the provider throttled us
+
+        Pauses from callers throttled at the same time overlap instead of adding up.
+        """
+        with self._locked_state():
+            now = time.time()
+            self._refill(now)
+            self.tokens = 0.0
+            self.updated_at = max(self.updated_at, now + seconds)
+
+class CircuitBreaker:
+    """Stops calling a provider after repeated failures and probes it again later"""
+    def __init__(self, failure_threshold: int = BREAKER_FAILURE_THRESHOLD, reset_timeout: float = BREAKER_RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.probing = False
+        self.lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """Return True if a call may go through"""
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            # Half-open: let a single probe through once the timeout has passed
+            if not self.probing and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.probing = True
+                return True
+            return False
+
+    def retry_after(self) -> float:
+        """Seconds until the breaker lets a probe through, 0 if it is closed"""
+        with self.lock:
+            if self.opened_at is None:
+                return 0.0
+            return max(0.0, self.opened_at + self.reset_timeout - time.monotonic())
+
+    def record_success(self) -> None:
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+
+    def record_response(self) -> None:
+        """The provider answered, but not with a success (throttled or a permanent error)
+
+        That says nothing against its health, so it doesn't count as a failure,
+        but it does end a half-open probe.
+        """
+        with self.lock:
+            if self.probing:
+                self.failures = 0
+                self.opened_at = None
+                self.probing = False
+
+    def record_failure(self) -> None:
+        with self.lock:
+            self.failures += 1
+            if self.probing or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+                self.probing = False
+
+class ApiLimiter:
+    """Rate limit and concurrency cap for one provider API"""
+    def __init__(self, rate: float, burst: float, max_concurrency: int, state_file: Optional[str] = None):
+        self.bucket = TokenBucket(rate, burst, state_file)
+        self.semaphore = threading.BoundedSemaphore(int(max_concurrency))
+
+_registry_lock = threading.Lock()
+_limiters: Dict[Tuple[str, str], ApiLimiter] = {}
+_breakers: Dict[str, CircuitBreaker] = {}
+
+def _state_file(provider: str, api: str) -> str:
+    return os.path.join(RATE_LIMIT_STATE_DIR, f'{provider}_{api}.json')
+
+def _env_limits(provider: str, api: str) -> Dict[str, float]:
+    limits = dict(DEFAULT_LIMITS.get((provider, api), FALLBACK_LIMIT))
+    prefix = f'RATE_LIMIT_{provider}_{api}'.upper()
+    for key, suffix in LIMIT_ENV_SUFFIXES.items():
+        value = os.getenv(f'{prefix}_{suffix}')
+        if value:
+            limits[key] = float(value)
+    return limits
+
+def configure(provider: str, api: str, rate: float, burst: float, max_concurrency: int) -> None:
+    """Set the limits for a provider API in this process, replacing any existing limiter"""
+    with _registry_lock:
+        _limiters[(provider, api)] = ApiLimiter(rate, burst, max_concurrency, _state_file(provider, api))
+
+def configure_breaker(provider: str, failure_threshold: int, reset_timeout: float) -> None:
+    """Set the circuit breaker settings for a provider in this process, replacing any existing breaker"""
+    with _registry_lock:
+        _breakers[provider] = CircuitBreaker(failure_threshold, reset_timeout)
+
+def get_limiter(provider: str, api: str) -> ApiLimiter:
+    with _registry_lock:
+        if (provider, api) not in _limiters:
+            _limiters[(provider, api)] = ApiLimiter(**_env_limits(provider, api), state_file=_state_file(provider, api))
+        return _limiters[(provider, api)]
+
+def get_breaker(provider: str) -> CircuitBreaker:
+    with _registry_lock:
+        if provider not in _breakers:
+            _breakers[provider] = CircuitBreaker()
+        return _breakers[provider]
+
+def _error_status(error: Exception) -> Optional[int]:
+    # ProviderError, oss2 exceptions and requests.HTTPError all expose the status differently
+    for attr in ('status_code', 'status'):
+        status = getattr(error, attr, None)
+        if isinstance(status, int):
+            return status
+    response = getattr(error, 'response', None)
+    status = getattr(response, 'status_code', None)
+    return status if isinstance(status, int) else None
+
+def is_throttling_error(error: Exception) -> bool:
+    """Return True if the provider asked us to slow down"""
+    if _error_status(error) in THROTTLING_STATUS_CODES:
+        return True
+    code = str(getattr(error, 'code', '') or '').lower()
+    return any(marker in code for marker in THROTTLING_ERROR_CODES)
+
+def is_transient_error(error: Exception) -> bool:
+    """Return True for server-side and connection failures that may succeed on retry"""
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    # requests raises its own ConnectionError/Timeout which don't subclass the builtins
+    if type(error).__name__ in ('ConnectionError', 'Timeout', 'ConnectTimeout', 'ReadTimeout', 'RequestError'):
+        return True
+    status = _error_status(error)
+    # oss2 reports network failures with a negative status
+    return status is not None and (status in TRANSIENT_STATUS_CODES or status < 0)
+
+def is_retryable_error(error: Exception) -> bool:
+    """Return True for throttling and transient errors, False for permanent ones"""
+    return is_throttling_error(error) or is_transient_error(error)
+
+def backoff_delay(attempt: int) -> float:
+    """Exponential backoff with full jitter"""
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt)))
+
+def call_with_retry(provider: str, api: str, func: Callable[..., Any], *args,
+                    max_retries: int = MAX_RETRIES, idempotent: bool = True, **kwargs) -> Any:
+    """Call `func` under the provider's rate limit, concurrency cap and circuit breaker
+
+    Throttling errors pause the API's bucket and are retried with jittered
+    exponential backoff. Transient errors (5xx, connection failures) count
+    against the circuit breaker and are retried the same way, unless the call
+    is not `idempotent`: a transient error may mean the request already
+    reached the server, so only throttled (rejected) calls are retried then.
+    """
+    limiter = get_limiter(provider, api)
+    breaker = get_breaker(provider)
+
+    attempt = 0
+    while True:
+        # A new call fails fast while the breaker is open, a call already retrying waits it out
+        while not breaker.allow():
+            if attempt == 0:
+                raise CircuitOpenError(f"Circuit open for {provider}, skipping {api} call")
+            time.sleep(max(breaker.retry_after(), BREAKER_POLL_INTERVAL))
+
+        limiter.bucket.acquire()
+        with limiter.semaphore:
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                throttled = is_throttling_error(e)
+                transient = not throttled and is_transient_error(e)
+                if transient:
+                    breaker.record_failure()
+                else:
+                    breaker.record_response()
+                if not (throttled or (transient and idempotent)) or attempt >= max_retries:
+                    raise
+                delay = backoff_delay(attempt)
+                print(f"{provider} {api} failed ({str(e)}), retrying in {delay:.1f}s")
+            else:
+                breaker.record_success()
+                return result
+
+        if throttled:
+            # Hold back every caller of this API; acquire() does the waiting
+            limiter.bucket.pause(delay)
+        else:
+            time.sleep(delay)
+        attempt += 1
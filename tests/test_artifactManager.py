@@ -0,0 +1,92 @@
+import os
+import subprocess
+
+import pytest
+
+import artifactManager
+from artifactManager import register_artifact, evict_to_budget, get_usage_report, get_pinned_jobs, pinned
+
+JOB_A = 'a' * 32
+JOB_B = 'b' * 32
+MB = 1024 * 1024
+
+
+class FakeClock:
+    """Stands in for the time module so access times are deterministic"""
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        self.now += 1
+        return self.now
+
+
+@pytest.fixture
+def temp_dir(tmp_path, monkeypatch):
+    temp = tmp_path / 'temp'
+    temp.mkdir()
+    monkeypatch.setattr(artifactManager, 'TEMP_DIR', str(temp))
+    monkeypatch.setattr(artifactManager, 'ARTIFACT_INDEX_FILE', str(temp / 'artifact_index.json'))
+    monkeypatch.setattr(artifactManager, 'ARTIFACT_LOCK_FILE', str(temp / 'artifact_index.lock'))
+    monkeypatch.setattr(artifactManager, 'PIN_DIR', str(temp / 'pins'))
+    monkeypatch.setattr(artifactManager, 'time', FakeClock())
+    return temp
+
+
+def make_file(directory, name, size_mb, job):
+    path = os.path.join(str(directory), name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(b'\0' * int(size_mb * MB))
+    return register_artifact(path, job)
+
+
+def test_evicts_media_before_transcripts_least_recently_used_first(temp_dir):
+    old_transcript = make_file(temp_dir, f'{JOB_A}_transcript.json', 1, JOB_A)
+    old_video = make_file(temp_dir, f'original_{JOB_A}.mp4', 2, JOB_A)
+    new_video = make_file(temp_dir, f'original_{JOB_B}.mp4', 2, JOB_B)
+    new_transcript = make_file(temp_dir, f'{JOB_B}_transcript.json', 1, JOB_B)
+
+    assert evict_to_budget(4) == [old_video]
+    assert evict_to_budget(1) == [new_video, old_transcript]
+    assert os.path.exists(new_transcript)
+
+
+def test_pinned_jobs_are_not_evicted(temp_dir):
+    video_a = make_file(temp_dir, f'original_{JOB_A}.mp4', 2, JOB_A)
+    video_b = make_file(temp_dir, f'original_{JOB_B}.mp4', 2, JOB_B)
+
+    with pinned(JOB_A):
+        assert get_pinned_jobs() == [JOB_A]
+        assert evict_to_budget(0) == [video_b]
+    assert os.path.exists(video_a)
+    assert get_pinned_jobs() == []
+
+
+def test_dead_process_pins_are_removed_and_stray_files_ignored(temp_dir):
+    process = subprocess.Popen(['true'])
+    process.wait()
+    pin_dir = temp_dir / 'pins'
+    pin_dir.mkdir()
+    (pin_dir / f'{JOB_A}.{process.pid}.pin').touch()
+    (pin_dir / f'{JOB_B}.{os.getpid()}.pin').touch()
+    (pin_dir / '.DS_Store').touch()
+    (pin_dir / 'notes.txt').touch()
+
+    assert get_pinned_jobs() == [JOB_B]
+    assert not (pin_dir / f'{JOB_A}.{process.pid}.pin').exists()
+    assert (pin_dir / '.DS_Store').exists()
+
+
+def test_unregistered_fingerprints_are_adopted_and_evicted(temp_dir):
+    fingerprints = temp_dir / 'fingerprints'
+    fingerprints.mkdir()
+    fingerprint = fingerprints / f'{JOB_A}.npy'
+    fingerprint.write_bytes(b'\0' * MB)
+    (temp_dir / 'pins').mkdir()
+    (temp_dir / 'pins' / f'{JOB_B}.{os.getpid()}.pin').touch()
+
+    report = get_usage_report()
+    assert report['total_bytes'] == MB
+    assert report['by_job'] == {JOB_A: MB}
+    assert evict_to_budget(0) == [str(fingerprint)]
@@ -0,0 +1,186 @@
+import time
+import threading
+import multiprocessing
+import urllib.request
+import urllib.error
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import rateLimiter
+from rateLimiter import call_with_retry, configure, configure_breaker, get_breaker, get_limiter, CircuitOpenError, TokenBucket
+
+
+class FakeServer:
+    """Local HTTP server answering with scripted status codes, 200 once the script runs out"""
+    def __init__(self):
+        self.statuses = deque()
+        self.request_times = []
+        self.lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                with server.lock:
+                    server.request_times.append(time.monotonic())
+                    status = server.statuses.popleft() if server.statuses else 200
+                self.send_response(status)
+                self.end_headers()
+                self.wfile.write(b'ok')
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.httpd.server_port}/'
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def get(self):
+        with urllib.request.urlopen(self.url) as response:
+            return response.read()
+
+
+@pytest.fixture(autouse=True)
+def state_dir(tmp_path, monkeypatch):
+    """Keep the shared token bucket state of each test in its own directory"""
+    monkeypatch.setattr(rateLimiter, 'RATE_LIMIT_STATE_DIR', str(tmp_path))
+    return tmp_path
+
+
+@pytest.fixture
+def server():
+    fake_server = FakeServer()
+    yield fake_server
+    fake_server.httpd.shutdown()
+
+
+@pytest.fixture
+def provider(request, monkeypatch):
+    """A provider name unique to the test, with fast backoff and a generous rate limit"""
+    monkeypatch.setattr(rateLimiter, 'BACKOFF_BASE', 0.01)
+    monkeypatch.setattr(rateLimiter, 'BREAKER_POLL_INTERVAL', 0.01)
+    name = request.node.name
+    configure(name, 'get', rate=1000, burst=1000, max_concurrency=10)
+    return name
+
+
+def test_retries_throttling_and_transient_errors_then_succeeds(server, provider):
+    server.statuses.extend([429, 503, 429])
+
+    assert call_with_retry(provider, 'get', server.get) == b'ok'
+    assert len(server.request_times) == 4
+
+
+def test_permanent_error_is_not_retried(server, provider):
+    server.statuses.append(404)
+
+    with pytest.raises(urllib.error.HTTPError):
+        call_with_retry(provider, 'get', server.get)
+    assert len(server.request_times) == 1
+
+
+def test_throttling_does_not_open_breaker(server, provider):
+    configure_breaker(provider, failure_threshold=2, reset_timeout=60)
+    server.statuses.extend([429] * 6)
+
+    assert call_with_retry(provider, 'get', server.get, max_retries=6) == b'ok'
+    assert get_breaker(provider).opened_at is None
+
+
+def test_non_idempotent_call_is_retried_only_when_throttled(server, provider):
+    server.statuses.extend([429, 503])
+
+    with pytest.raises(urllib.error.HTTPError) as error:
+        call_with_retry(provider, 'get', server.get, idempotent=False)
+    assert error.value.code == 503
+    assert len(server.request_times) == 2
+
+
+def test_breaker_opens_and_half_opens(server, provider):
+    configure_breaker(provider, failure_threshold=2, reset_timeout=0.3)
+    server.statuses.extend([503, 503])
+
+    with pytest.raises(urllib.error.HTTPError):
+        call_with_retry(provider, 'get', server.get, max_retries=1)
+
+    # Open: new calls fail without reaching the server
+    with pytest.raises(CircuitOpenError):
+        call_with_retry(provider, 'get', server.get)
+    assert len(server.request_times) == 2
+
+    # Half-open after the reset timeout: a successful probe closes the breaker
+    time.sleep(0.3)
+    assert call_with_retry(provider, 'get', server.get) == b'ok'
+    assert get_breaker(provider).opened_at is None
+
+
+def test_retry_waits_for_open_breaker_instead_of_giving_up(server, provider):
+    configure_breaker(provider, failure_threshold=2, reset_timeout=0.3)
+    server.statuses.extend([503, 503])
+
+    start_time = time.monotonic()
+    assert call_with_retry(provider, 'get', server.get, max_retries=5) == b'ok'
+    assert time.monotonic() - start_time >= 0.3
+    assert len(server.request_times) == 3
+
+
+def test_throughput_stays_at_configured_rate(server, provider):
+    rate = 20
+    configure(provider, 'get', rate=rate, burst=1, max_concurrency=4)
+    calls = 30
+
+    def worker():
+        for _ in range(calls // 10):
+            call_with_retry(provider, 'get', server.get)
+
+    threads = [threading.Thread(target=worker) for _ in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(server.request_times) == calls
+    elapsed = server.request_times[-1] - server.request_times[0]
+    assert (calls - 1) / elapsed <= rate * 1.05
+
+
+def test_concurrent_pauses_do_not_add_up():
+    bucket = TokenBucket(rate=100, burst=1)
+    for _ in range(5):
+        bucket.pause(0.2)
+
+    start_time = time.monotonic()
+    bucket.acquire()
+    assert 0.15 <= time.monotonic() - start_time < 0.35
+
+
+def _acquire_tokens(provider, count, times):
+    for _ in range(count):
+        get_limiter(provider, 'get').bucket.acquire()
+        times.put(time.time())
+
+
+def test_rate_is_shared_between_processes(provider):
+    rate = 20
+    configure(provider, 'get', rate=rate, burst=1, max_concurrency=4)
+    context = multiprocessing.get_context('fork')
+    times = context.Queue()
+    processes = [context.Process(target=_acquire_tokens, args=(provider, 8, times)) for _ in range(3)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+    acquired = sorted(times.get() for _ in range(24))
+    assert (len(acquired) - 1) / (acquired[-1] - acquired[0]) <= rate * 1.05
+
+
+def test_limits_are_read_from_env(monkeypatch):
+    monkeypatch.setenv('RATE_LIMIT_ENVTEST_GET_RATE', '3.5')
+    monkeypatch.setenv('RATE_LIMIT_ENVTEST_GET_BURST', '7')
+    limiter = get_limiter('envtest', 'get')
+    assert limiter.bucket.rate == 3.5
+    assert limiter.bucket.burst == 7
+    # Not overridden, so it keeps the fallback
+    assert limiter.semaphore._initial_value == 1
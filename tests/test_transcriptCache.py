@@ -0,0 +1,126 @@
+import numpy as np
+import pytest
+
+import transcriptCache
+from transcriptCache import (
+    FINGERPRINT_HOP, FINGERPRINT_SAMPLE_RATE, _compute_fingerprint, match_fingerprints,
+    shift_sentences, store_transcript, lookup_by_audio, lookup_by_video, forget_files, get_video_id
+)
+
+
+@pytest.mark.parametrize('url', [
+    'https://youtu.be/l2JAsuVG_8c',
+    'https://youtu.be/l2JAsuVG_8c?t=30',
+    'https://www.youtube.com/watch?v=l2JAsuVG_8c',
+    'https://www.youtube.com/watch?v=l2JAsuVG_8c&t=30s',
+    'https://m.youtube.com/watch?v=l2JAsuVG_8c',
+    'https://www.youtube.com/watch?v=l2JAsuVG_8c&list=PLabc',
+    'https://www.youtube.com/watch?list=PLabc&v=l2JAsuVG_8c&index=3',
+    'https://www.youtube.com/shorts/l2JAsuVG_8c',
+])
+def test_video_id_ignores_url_variants(url):
+    assert get_video_id(url) == 'youtube:l2JAsuVG_8c'
+
+
+def test_videos_of_a_playlist_get_different_ids():
+    first = get_video_id('https://www.youtube.com/watch?v=l2JAsuVG_8c&list=PLabc')
+    second = get_video_id('https://www.youtube.com/watch?v=dQw4w9WgXcQ&list=PLabc')
+    assert first != second
+
+
+SHIFT_FRAMES = 40
+
+
+def make_audio(seed, seconds=60):
+    """Noise with a slowly varying loudness, standing in for decoded speech"""
+    rng = np.random.default_rng(seed)
+    n = seconds * FINGERPRINT_SAMPLE_RATE
+    envelope = 1 + 0.5 * np.sin(np.arange(n) / FINGERPRINT_SAMPLE_RATE)
+    return (rng.normal(0, 3000, n) * envelope).astype(np.float32)
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(transcriptCache, 'CACHE_INDEX_FILE', str(tmp_path / 'transcript_cache.json'))
+    monkeypatch.setattr(transcriptCache, 'FINGERPRINT_DIR', str(tmp_path / 'fingerprints'))
+    return tmp_path
+
+
+def test_match_finds_offset_of_trimmed_noisy_copy():
+    audio = make_audio(0)
+    noise = np.random.default_rng(1).normal(0, 300, len(audio) - SHIFT_FRAMES * FINGERPRINT_HOP)
+    trimmed = audio[SHIFT_FRAMES * FINGERPRINT_HOP:] + noise.astype(np.float32)
+    # The trimmed copy starts SHIFT_FRAMES frames into the original
+    assert match_fingerprints(_compute_fingerprint(trimmed), _compute_fingerprint(audio)) == SHIFT_FRAMES
+    assert match_fingerprints(_compute_fingerprint(audio), _compute_fingerprint(trimmed)) == -SHIFT_FRAMES
+
+
+def test_match_rejects_different_audio_and_different_length():
+    audio = _compute_fingerprint(make_audio(0))
+    assert match_fingerprints(_compute_fingerprint(make_audio(2)), audio) is None
+    assert match_fingerprints(audio[:int(len(audio) * 0.8)], audio) is None
+
+
+def test_silence_has_no_fingerprint():
+    assert _compute_fingerprint(np.zeros(60 * FINGERPRINT_SAMPLE_RATE, dtype=np.float32)) is None
+
+
+def test_shift_sentences_moves_and_drops():
+    sentences = [
+        {'start_time': 0.5, 'end_time': 1.5, 'text': 'a'},
+        {'start_time': 2.0, 'end_time': 3.0, 'text': 'b'},
+    ]
+    assert shift_sentences(sentences, 0.0) is sentences
+    assert shift_sentences(sentences, -1.0) == [
+        {'start_time': 0.0, 'end_time': 0.5, 'text': 'a'},
+        {'start_time': 1.0, 'end_time': 2.0, 'text': 'b'},
+    ]
+    assert shift_sentences(sentences, -2.0) == [{'start_time': 0.0, 'end_time': 1.0, 'text': 'b'}]
+    assert shift_sentences(sentences, 1.0)[0] == {'start_time': 1.5, 'end_time': 2.5, 'text': 'a'}
+
+
+def test_lookup_by_audio_returns_offset_and_preferred_backend(cache_dir):
+    audio = make_audio(0)
+    fingerprint = _compute_fingerprint(audio)
+    for backend in ('slow', 'fast'):
+        transcript = cache_dir / f'{backend}.json'
+        transcript.write_text('{}')
+        store_transcript('a' * 32, fingerprint, backend, 'm', str(transcript))
+
+    query = _compute_fingerprint(audio[SHIFT_FRAMES * FINGERPRINT_HOP:])
+    backend, transcript, offset = lookup_by_audio(query, [('fast', 'm'), ('slow', 'm')])
+    assert backend == 'fast'
+    assert transcript == str(cache_dir / 'fast.json')
+    # Our audio starts later, so the cached transcript times move back
+    assert offset == pytest.approx(-SHIFT_FRAMES * FINGERPRINT_HOP / FINGERPRINT_SAMPLE_RATE)
+    assert lookup_by_audio(query, [('other', 'm')]) is None
+
+
+def test_lookup_by_audio_skips_other_lengths_without_loading(cache_dir, monkeypatch):
+    fingerprint = _compute_fingerprint(make_audio(0))
+    transcript = cache_dir / 'transcript.json'
+    transcript.write_text('{}')
+    store_transcript('a' * 32, fingerprint, 'fast', 'm', str(transcript))
+
+    def fail_load(path):
+        raise AssertionError(f'loaded {path}')
+    monkeypatch.setattr(transcriptCache.np, 'load', fail_load)
+    assert lookup_by_audio(fingerprint[:len(fingerprint) // 2], [('fast', 'm')]) is None
+
+
+def test_forget_files_drops_entries_of_evicted_files(cache_dir):
+    fingerprint = _compute_fingerprint(make_audio(0))
+    transcript = cache_dir / 'transcript.json'
+    transcript.write_text('{}')
+    fingerprint_file = store_transcript('a' * 32, fingerprint, 'fast', 'm', str(transcript))
+    other = cache_dir / 'other.json'
+    other.write_text('{}')
+    store_transcript('b' * 32, None, 'fast', 'm', str(other))
+
+    forget_files([fingerprint_file])
+    assert lookup_by_video('a' * 32, 'fast', 'm') == (str(transcript), 0.0)
+    assert lookup_by_audio(fingerprint, [('fast', 'm')]) is None
+
+    forget_files([str(transcript)])
+    assert lookup_by_video('a' * 32, 'fast', 'm') is None
+    assert lookup_by_video('b' * 32, 'fast', 'm') == (str(other), 0.0)
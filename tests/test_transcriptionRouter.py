@@ -0,0 +1,169 @@
+import time
+import threading
+
+import pytest
+
+import transcriptionRouter
+from transcriptionRouter import TranscriptionBackend, TranscriptionRouter, LatencyHistogram, normalize_transcript
+
+
+class FakeBackend(TranscriptionBackend):
+    """Backend answering after `delay` seconds, or failing, and recording what happened"""
+    def __init__(self, name, delay=0.0, succeed=True, cached=False):
+        self.name = name
+        self.model = 'fake'
+        self.delay = delay
+        self.succeed = succeed
+        self.cached = cached
+        self.started = threading.Event()
+        self.cancelled = threading.Event()
+
+    def has_cached_result(self, file_hash):
+        return self.cached
+
+    def transcribe(self, audio_path, file_hash, cancel_event):
+        self.started.set()
+        if cancel_event.wait(self.delay):
+            self.cancelled.set()
+            return None
+        if not self.succeed:
+            return None
+        return normalize_transcript(self.name, self.model, [
+            {'start_time': 0.0, 'end_time': 1.0, 'text': f'from {self.name}'}
+        ])
+
+
+def make_router(primary, secondaries, latency_budget=0.3):
+    return TranscriptionRouter(primary, secondaries, latency_budget=latency_budget, stats_file=None)
+
+
+def test_no_hedge_when_primary_answers_within_budget():
+    primary = FakeBackend('primary', delay=0.05)
+    secondary = FakeBackend('secondary')
+    backend, transcript = make_router(primary, [secondary]).transcribe('audio.m4a', 'hash', audio_duration=None)
+    assert backend is primary
+    assert transcript['text'] == 'from primary'
+    assert not secondary.started.is_set()
+
+
+def test_hedges_after_budget_and_secondary_wins():
+    primary = FakeBackend('primary', delay=5.0)
+    secondary = FakeBackend('secondary', delay=0.05)
+    start = time.monotonic()
+    backend, transcript = make_router(primary, [secondary]).transcribe('audio.m4a', 'hash', audio_duration=None)
+    elapsed = time.monotonic() - start
+    assert backend is secondary
+    assert transcript['backend'] == 'secondary'
+    assert 0.3 <= elapsed < 1.0
+
+
+def test_fails_over_immediately():
+    primary = FakeBackend('primary', succeed=False)
+    secondary = FakeBackend('secondary')
+    router = make_router(primary, [secondary], latency_budget=10.0)
+    start = time.monotonic()
+    backend, _ = router.transcribe('audio.m4a', 'hash', audio_duration=None)
+    assert backend is secondary
+    assert time.monotonic() - start < 1.0
+
+
+def test_returns_none_when_all_backends_fail():
+    primary = FakeBackend('primary', succeed=False)
+    secondary = FakeBackend('secondary', succeed=False)
+    assert make_router(primary, [secondary]).transcribe('audio.m4a', 'hash', audio_duration=None) is None
+
+
+def test_loser_is_cancelled():
+    primary = FakeBackend('primary', delay=5.0)
+    secondary = FakeBackend('secondary', delay=0.05)
+    make_router(primary, [secondary]).transcribe('audio.m4a', 'hash', audio_duration=None)
+    assert primary.cancelled.wait(1.0)
+
+
+def test_loser_past_its_threshold_is_recorded_and_cached_winner_is_not(monkeypatch):
+    monkeypatch.setattr(transcriptionRouter, 'MIN_HEDGE_DELAY', 0.0)
+    primary = FakeBackend('primary', delay=5.0)
+    secondary = FakeBackend('secondary', delay=0.05, cached=True)
+    router = TranscriptionRouter(primary, [secondary], latency_ratio=0.01, stats_file=None)
+    backend, _ = router.transcribe('audio.m4a', 'hash', audio_duration=10.0)
+    assert backend is secondary
+    # The primary ran past its 0.1s threshold before being cancelled
+    assert router.histograms['primary'].total == 1
+    assert 'secondary' not in router.histograms
+
+
+def test_loser_cancelled_before_its_threshold_is_not_recorded(monkeypatch):
+    monkeypatch.setattr(transcriptionRouter, 'MIN_HEDGE_DELAY', 0.0)
+    primary = FakeBackend('primary', delay=0.25)
+    secondary = FakeBackend('secondary', delay=5.0)
+    # Hedges at 0.2s, so the secondary has run ~0.05s of its 0.2s threshold when it loses
+    router = TranscriptionRouter(primary, [secondary], latency_ratio=0.02, stats_file=None)
+    backend, _ = router.transcribe('audio.m4a', 'hash', audio_duration=10.0)
+    assert backend is primary
+    assert secondary.cancelled.wait(1.0)
+    assert router.histograms['primary'].total == 1
+    assert 'secondary' not in router.histograms
+
+
+def test_stats_are_merged_between_routers_sharing_a_file(tmp_path):
+    stats_file = str(tmp_path / 'router_latency.json')
+    first = TranscriptionRouter(FakeBackend('primary'), [], stats_file=stats_file)
+    second = TranscriptionRouter(FakeBackend('primary'), [], stats_file=stats_file)
+    first.record_latency(first.primary, 1.0, 10.0)
+    second.record_latency(second.primary, 1.0, 10.0)
+    first.record_latency(first.primary, 1.0, 10.0)
+
+    third = TranscriptionRouter(FakeBackend('primary'), [], stats_file=stats_file)
+    third.hedge_delay(third.primary, 10.0)
+    assert third.histograms['primary'].total == pytest.approx(
+        sum(transcriptionRouter.HISTOGRAM_DECAY ** age for age in range(3)))
+
+
+def test_old_samples_decay():
+    histogram = LatencyHistogram()
+    for _ in range(200):
+        histogram.record(5.0)
+    for _ in range(200):
+        histogram.record(0.1)
+    # The backend got faster, the threshold follows
+    assert histogram.quantile(0.9) < 0.2
+    assert histogram.total < 1 / (1 - transcriptionRouter.HISTOGRAM_DECAY)
+
+
+def test_cold_start_hedge_delay_scales_with_duration():
+    router = TranscriptionRouter(FakeBackend('primary'), [], latency_ratio=0.5, latency_budget=120, stats_file=None)
+    assert router.hedge_delay(router.primary, 600.0) == pytest.approx(300.0)
+    assert router.hedge_delay(router.primary, None) == 120
+
+
+@pytest.fixture
+def pipeline(tmp_path, monkeypatch):
+    """Run the pipeline in an empty working directory with downloads and muxing faked"""
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'temp').mkdir()
+    monkeypatch.setattr(transcriptionRouter, 'get_video_hash', lambda url: 'a' * 32)
+    monkeypatch.setattr(transcriptionRouter, 'get_audio_fingerprint', lambda path: None)
+    monkeypatch.setattr(transcriptionRouter, 'download_youtube_audio', lambda url, file_hash: 'temp/audio.m4a')
+    monkeypatch.setattr(transcriptionRouter, 'download_youtube_video', lambda url, file_hash: 'temp/video.mp4')
+    monkeypatch.setattr(transcriptionRouter, 'embed_subtitles',
+                        lambda video, srt, file_hash, prefix: f'temp/{prefix}_{file_hash}.mp4')
+    return tmp_path
+
+
+def test_pipeline_stores_transcript_of_the_winner(pipeline):
+    primary = FakeBackend('primary', succeed=False)
+    secondary = FakeBackend('secondary')
+    router = make_router(primary, [secondary])
+    output = transcriptionRouter.process_youtube_video('https://youtu.be/x', router, 'test_output')
+    assert output == f"temp/test_output_{'a' * 32}.mp4"
+    assert transcriptionRouter.lookup_by_video('a' * 32, 'secondary', secondary.cache_model)
+    assert not transcriptionRouter.lookup_by_video('a' * 32, 'primary', primary.cache_model)
+
+
+@pytest.mark.parametrize('failed_download', ['download_youtube_audio', 'download_youtube_video'])
+def test_pipeline_stops_on_failed_download(pipeline, monkeypatch, capsys, failed_download):
+    monkeypatch.setattr(transcriptionRouter, failed_download, lambda url, file_hash: None)
+    router = make_router(FakeBackend('primary'), [])
+    assert transcriptionRouter.process_youtube_video('https://youtu.be/x', router) is None
+    kind = 'audio' if failed_download == 'download_youtube_audio' else 'video'
+    assert f"Failed to download {kind}" in capsys.readouterr().out
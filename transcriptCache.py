@@ -0,0 +1,285 @@
+import os
+import json
+import hashlib
+import subprocess
+import threading
+import tempfile
+from typing import Optional, List, Dict, Tuple
+
+import numpy as np
+import yt_dlp
+from yt_dlp.extractor import gen_extractor_classes
+from numpy.lib.stride_tricks import sliding_window_view
+
+CACHE_INDEX_FILE = os.path.join('temp', 'transcript_cache.json')
+FINGERPRINT_DIR = os.path.join('temp', 'fingerprints')
+
+# Audio fingerprint parameters (Haitsma-Kalker style sub-fingerprints):
+# one 32-bit value per hop, from energy differences of 33 bands between 300 and 2000 Hz
+FINGERPRINT_SAMPLE_RATE = 5512
+FINGERPRINT_FRAME_SIZE = 2048
+FINGERPRINT_HOP = 256
+FINGERPRINT_BANDS = 33
+FINGERPRINT_MIN_HZ = 300
+FINGERPRINT_MAX_HZ = 2000
+FINGERPRINT_CHUNK_FRAMES = 4096
+
+# Frames quieter than this RMS (int16 scale) count as silence
+SILENCE_RMS = 100
+# Clips that are mostly silence or repetitive carry too little information to match safely
+MAX_SILENT_FRACTION = 0.5
+MIN_UNIQUE_FRACTION = 0.5
+
+# Matching parameters: blocks of 256 sub-fingerprints (~12 s) are compared by bit error
+# rate at the offsets voted for by exactly matching sub-fingerprints
+PROBE_SIZE = 256
+PROBE_POSITIONS = (0.25, 0.5, 0.75)
+MIN_MATCHING_PROBES = 2
+MAX_BIT_ERROR_RATE = 0.35
+MAX_OFFSET_CANDIDATES = 8
+MAX_POSITIONS_PER_VALUE = 16
+OFFSET_TOLERANCE = 2
+# Only reuse transcripts of audio with about the same length (e.g. not a short clip of a long video)
+MAX_LENGTH_DIFFERENCE = 0.1
+
+_index_lock = threading.Lock()
+
+def get_video_id(youtube_url: str) -> str:
+    """Resolve a URL to its canonical '<extractor>:<id>' form"""
+    # Match the URL against the extractor patterns first so that no network
+    # request is needed for the common case (youtu.be, watch?v=, &t=30s ...).
+    # Only video extractors are tried, and their pattern is matched directly:
+    # suitable() hands watch?v=...&list=... URLs to the playlist extractor,
+    # which would give every video of a playlist the playlist's ID.
+    for ie in gen_extractor_classes():
+        if ie.ie_key() == 'Generic' or getattr(ie, '_RETURN_TYPE', None) != 'video':
+            continue
+        if not ie._match_valid_url(youtube_url):
+            continue
+        video_id = ie.get_temp_id(youtube_url)
+        if video_id:
+            return f"{ie.ie_key().lower()}:{video_id}"
+        break
+
+    # Fall back to asking yt-dlp for the metadata of the video, not of its playlist
+    with yt_dlp.YoutubeDL({'quiet': True, 'nocheckcertificate': True, 'noplaylist': True}) as ydl:
+        info = ydl.extract_info(youtube_url, download=False, process=False)
+    return f"{(info.get('ie_key') or info['extractor_key']).lower()}:{info['id']}"
+
+def get_video_hash(youtube_url: str) -> str:
+    """Generate a hash from the canonical video ID of a YouTube URL"""
+    return hashlib.md5(get_video_id(youtube_url).encode()).hexdigest()
+
+def _compute_fingerprint(samples: np.ndarray) -> Optional[np.ndarray]:
+    """Turn mono PCM samples into an array of 32-bit sub-fingerprints"""
+    if len(samples) < FINGERPRINT_FRAME_SIZE + FINGERPRINT_HOP * (PROBE_SIZE + 1):
+        return None
+
+    window = np.hanning(FINGERPRINT_FRAME_SIZE)
+    band_edges = np.geomspace(FINGERPRINT_MIN_HZ, FINGERPRINT_MAX_HZ, FINGERPRINT_BANDS + 1)
+    band_bins = np.round(band_edges * FINGERPRINT_FRAME_SIZE / FINGERPRINT_SAMPLE_RATE).astype(int)
+    frames = sliding_window_view(samples, FINGERPRINT_FRAME_SIZE)[::FINGERPRINT_HOP]
+
+    # Work in chunks so long videos don't need the whole spectrogram in memory
+    energies = []
+    silent_frames = 0
+    for start in range(0, len(frames), FINGERPRINT_CHUNK_FRAMES):
+        chunk = frames[start:start + FINGERPRINT_CHUNK_FRAMES]
+        silent_frames += int(np.sum(np.sqrt(np.mean(chunk ** 2, axis=1)) < SILENCE_RMS))
+        spectrum = np.abs(np.fft.rfft(chunk * window, axis=1)) ** 2
+        energies.append(np.add.reduceat(spectrum, band_bins, axis=1)[:, :FINGERPRINT_BANDS])
+    if silent_frames > MAX_SILENT_FRACTION * len(frames):
+        return None
+
+    energy = np.concatenate(energies)
+    band_diff = energy[:, :-1] - energy[:, 1:]
+    bits = (band_diff[1:] - band_diff[:-1]) > 0
+    fingerprint = np.ascontiguousarray(np.packbits(bits, axis=1, bitorder='little')).view('<u4').ravel()
+    if len(np.unique(fingerprint)) < MIN_UNIQUE_FRACTION * len(fingerprint):
+        return None
+    return fingerprint
+
+def get_audio_fingerprint(audio_path: str) -> Optional[np.ndarray]:
+    """Fingerprint the decoded audio content of a file
+
+    The result does not depend on container, codec or volume, and is compared
+    by bit error rate rather than equality, so re-encoded or shifted copies of
+    the same audio still match. Returns None for audio that is too short or
+    too quiet to be matched reliably.
+    """
+    cmd = [
+        'ffmpeg', '-v', 'error', '-i', audio_path,
+        '-ac', '1', '-ar', str(FINGERPRINT_SAMPLE_RATE),
+        '-f', 's16le', '-'
+    ]
+    try:
+        pcm = subprocess.run(cmd, check=True, capture_output=True).stdout
+    except (subprocess.CalledProcessError, FileNotFoundError) as e:
+        print(f"Error fingerprinting audio: {str(e)}")
+        return None
+
+    return _compute_fingerprint(np.frombuffer(pcm, dtype=np.int16).astype(np.float32))
+
+def _similar_length(a: int, b: int) -> bool:
+    return abs(a - b) <= MAX_LENGTH_DIFFERENCE * max(a, b)
+
+def _bit_error_rate(a: np.ndarray, b: np.ndarray) -> float:
+    return float(np.unpackbits((a ^ b).view(np.uint8)).mean())
+
+def match_fingerprints(query: np.ndarray, candidate: np.ndarray) -> Optional[int]:
+    """Return the frame offset at which `query` occurs in `candidate`, or None
+
+    Each probe block of the query votes for offsets where its sub-fingerprints
+    occur exactly in the candidate, and the best voted offsets are verified by
+    bit error rate. Enough probes must agree on the same offset.
+    """
+    if not _similar_length(len(query), len(candidate)):
+        return None
+    if len(query) < PROBE_SIZE or len(candidate) < PROBE_SIZE:
+        return None
+
+    order = np.argsort(candidate, kind='stable')
+    sorted_candidate = candidate[order]
+
+    offsets = []
+    for position in PROBE_POSITIONS:
+        start = int(position * (len(query) - PROBE_SIZE))
+        block = query[start:start + PROBE_SIZE]
+
+        votes: Dict[int, int] = {0: 0}
+        lefts = np.searchsorted(sorted_candidate, block, 'left')
+        rights = np.searchsorted(sorted_candidate, block, 'right')
+        for i, (left, right) in enumerate(zip(lefts, rights)):
+            # Skip values that are everywhere, they don't tell us the alignment
+            if right == left or right - left > MAX_POSITIONS_PER_VALUE:
+                continue
+            for candidate_index in order[left:right]:
+                offset = int(candidate_index) - (start + i)
+                votes[offset] = votes.get(offset, 0) + 1
+
+        best = None
+        for offset in sorted(votes, key=votes.get, reverse=True)[:MAX_OFFSET_CANDIDATES]:
+            candidate_start = start + offset
+            if candidate_start < 0 or candidate_start + PROBE_SIZE > len(candidate):
+                continue
+            error_rate = _bit_error_rate(block, candidate[candidate_start:candidate_start + PROBE_SIZE])
+            if error_rate < MAX_BIT_ERROR_RATE and (best is None or error_rate < best[1]):
+                best = (offset, error_rate)
+        if best:
+            offsets.append(best[0])
+
+    if not offsets:
+        return None
+    median_offset = int(np.median(offsets))
+    if sum(abs(offset - median_offset) <= OFFSET_TOLERANCE for offset in offsets) < MIN_MATCHING_PROBES:
+        return None
+    return median_offset
+
+def shift_sentences(sentences: List[Dict], offset: float, start_key: str = 'start_time', end_key: str = 'end_time') -> List[Dict]:
+    """Move sentence times (in seconds) by `offset`, dropping sentences that end before zero"""
+    if not offset:
+        return sentences
+    return [
+        {**sentence, start_key: max(0.0, sentence[start_key] + offset), end_key: sentence[end_key] + offset}
+        for sentence in sentences
+        if sentence[end_key] + offset > 0
+    ]
+
+def _cache_key(key: str, backend: str, model: str) -> str:
+    return f"{backend}|{model}|{key}"
+
+def _load_index() -> dict:
+    if not os.path.exists(CACHE_INDEX_FILE):
+        return {'videos': {}, 'audio': {}}
+    with open(CACHE_INDEX_FILE, 'r', encoding='utf-8') as f:
+        index = json.load(f)
+    index.setdefault('videos', {})
+    index.setdefault('audio', {})
+    return index
+
+def _save_index(index: dict) -> None:
+    os.makedirs(os.path.dirname(CACHE_INDEX_FILE), exist_ok=True)
+    # Write to a temp file and rename so concurrent readers never see a partial index
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(CACHE_INDEX_FILE), suffix='.tmp')
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        json.dump(index, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, CACHE_INDEX_FILE)
+
+def lookup_by_video(file_hash: str, backend: str, model: str) -> Optional[Tuple[str, float]]:
+    """Return a cached (transcript, offset) for a video, if any
+
+    The offset in seconds must be added to the transcript times to line them
+    up with this video's audio.
+    """
+    with _index_lock:
+        index = _load_index()
+    entry = index['videos'].get(_cache_key(file_hash, backend, model))
+    if entry and os.path.exists(entry['transcript']):
+        return entry['transcript'], entry['offset']
+    return None
+
+def lookup_by_audio(fingerprint: np.ndarray, backends: List[Tuple[str, str]]) -> Optional[Tuple[str, str, float]]:
+    """Return a cached (backend, transcript, offset) for the same audio content, if any
+
+    `backends` lists the acceptable (backend, model) pairs, most preferred
+    first. The cache is scanned once for all of them, only fingerprints of
+    about the same length are loaded, and each one is matched at most once.
+    """
+    with _index_lock:
+        index = _load_index()
+    ranks = {_cache_key('', backend, model): rank for rank, (backend, model) in enumerate(backends)}
+
+    matches: Dict[str, Optional[int]] = {}
+    best = None
+    for key, entry in index['audio'].items():
+        rank = ranks.get(key[:key.rindex('|') + 1])
+        if rank is None or (best and rank >= best[0]):
+            continue
+        # Entries written before the length was recorded have to be loaded to check it
+        if 'length' in entry and not _similar_length(len(fingerprint), entry['length']):
+            continue
+        if not os.path.exists(entry['transcript']) or not os.path.exists(entry['fingerprint']):
+            continue
+        # Backends transcribing the same video share its fingerprint file
+        if entry['fingerprint'] not in matches:
+            matches[entry['fingerprint']] = match_fingerprints(fingerprint, np.load(entry['fingerprint']))
+        frame_offset = matches[entry['fingerprint']]
+        if frame_offset is not None:
+            # Transcript times line up with the cached audio, which runs frame_offset frames ahead of ours
+            offset = entry['offset'] - frame_offset * FINGERPRINT_HOP / FINGERPRINT_SAMPLE_RATE
+            best = (rank, backends[rank][0], entry['transcript'], offset)
+    return best[1:] if best else None
+
+def store_transcript(file_hash: str, fingerprint: Optional[np.ndarray], backend: str, model: str,
+                     transcript_file: str, offset: float = 0.0) -> Optional[str]:
+    """Record a transcript under its video key and audio fingerprint
+
+    Returns the path of the saved fingerprint, if any, so the caller can
+    register it as an artifact of the job.
+    """
+    entry = {'transcript': transcript_file, 'offset': offset}
+    fingerprint_file = None
+    with _index_lock:
+        index = _load_index()
+        index['videos'][_cache_key(file_hash, backend, model)] = entry
+        if fingerprint is not None:
+            os.makedirs(FINGERPRINT_DIR, exist_ok=True)
+            fingerprint_file = os.path.join(FINGERPRINT_DIR, f'{file_hash}.npy')
+            np.save(fingerprint_file, fingerprint)
+            index['audio'][_cache_key(file_hash, backend, model)] = {**entry, 'fingerprint': fingerprint_file, 'length': len(fingerprint)}
+        _save_index(index)
+    return fingerprint_file
+
+def forget_files(paths: List[str]) -> None:
+    """Drop cache entries whose transcript or fingerprint was deleted, e.g. by eviction"""
+    if not paths:
+        return
+    paths = set(paths)
+    with _index_lock:
+        index = _load_index()
+        for section in ('videos', 'audio'):
+            index[section] = {
+                key: entry for key, entry in index[section].items()
+                if entry['transcript'] not in paths and entry.get('fingerprint') not in paths
+            }
+        _save_index(index)
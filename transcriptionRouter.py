@@ -0,0 +1,476 @@
+import os
+import json
+import math
+import time
+import queue
+import threading
+import fcntl
+import subprocess
+import tempfile
+from contextlib import contextmanager
+from typing import Optional, Dict, List, Tuple
+
+from dotenv import load_dotenv
+
+from videoUtils import download_youtube_audio, download_youtube_video, create_srt_from_transcript, embed_subtitles
+from artifactManager import pinned, register_artifact, evict_to_budget
+from transcriptCache import get_video_hash, get_audio_fingerprint, lookup_by_video, lookup_by_audio, store_transcript, forget_files, shift_sentences
+
+load_dotenv()
+
+# Version of the normalized transcript schema, part of the cache key of every routed transcript
+TRANSCRIPT_SCHEMA = 'normalized-v1'
+
+LATENCY_STATS_FILE = os.path.join('temp', 'router_latency.json')
+
+# Hedging defaults. Latencies are recorded as seconds of processing per second of audio,
+# so the hedge threshold scales with the length of the video. The absolute budget is
+# only used when the audio duration is unknown.
+DEFAULT_LATENCY_RATIO = float(os.getenv('HEDGE_LATENCY_RATIO', '0.5'))
+DEFAULT_LATENCY_BUDGET = float(os.getenv('HEDGE_LATENCY_BUDGET', '120'))
+HEDGE_QUANTILE = 0.9
+MIN_HEDGE_SAMPLES = 20
+MIN_HEDGE_DELAY = 5.0
+
+# Histogram buckets for processing-time/audio-time ratios, from 0.01x to ~100x
+HISTOGRAM_MIN = 0.01
+HISTOGRAM_GROWTH = 1.25
+HISTOGRAM_BUCKETS = 42
+# Counts decay by this factor on every new sample, so thresholds follow the last ~50 calls
+HISTOGRAM_DECAY = 0.98
+
+WHISPER_MODEL = 'base'
+
+def normalize_transcript(backend_name: str, model: str, sentences: List[Dict]) -> Dict:
+    """Build a transcript in the schema shared by all backends (times in seconds)"""
+    sentences = [
+        {
+            'start_time': float(sentence['start_time']),
+            'end_time': float(sentence['end_time']),
+            'text': sentence['text'].strip()
+        }
+        for sentence in sentences
+        if sentence['text'].strip()
+    ]
+    return {
+        'schema': TRANSCRIPT_SCHEMA,
+        'backend': backend_name,
+        'model': model,
+        'text': ' '.join(sentence['text'] for sentence in sentences),
+        'sentences': sentences
+    }
+
+def load_transcript(transcript_file: str) -> Optional[Dict]:
+    """Read a normalized transcript JSON file"""
+    try:
+        with open(transcript_file, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"Error reading transcript: {str(e)}")
+        return None
+
+def get_audio_duration(audio_path: str) -> Optional[float]:
+    """Return the duration of an audio file in seconds using ffprobe"""
+    cmd = [
+        'ffprobe', '-v', 'error',
+        '-show_entries', 'format=duration',
+        '-of', 'csv=p=0', audio_path
+    ]
+    try:
+        output = subprocess.run(cmd, check=True, capture_output=True, text=True).stdout
+        return float(output.strip())
+    except (subprocess.CalledProcessError, FileNotFoundError, ValueError) as e:
+        print(f"Error reading audio duration: {str(e)}")
+        return None
+
+class TranscriptionBackend:
+    """Interface for a speech recognition backend used by the router"""
+    name = ''
+    model = ''
+
+    @property
+    def cache_model(self) -> str:
+        return f'{self.model}:{TRANSCRIPT_SCHEMA}'
+
+    def has_cached_result(self, file_hash: str) -> bool:
+        """Return True if the backend would answer from a local file instead of doing the work"""
+        return False
+
+    def transcribe(self, audio_path: str, file_hash: str, cancel_event: threading.Event) -> Optional[Dict]:
+        """Transcribe an audio file and return a normalized transcript, or None on failure
+
+        Implementations should stop, and stop paying for the provider, once
+        `cancel_event` is set, because another backend already won.
+        """
+        raise NotImplementedError
+
+class SenseVoiceBackend(TranscriptionBackend):
+    def __init__(self):
+        # Imported here so that routers without this backend don't load DashScope/OSS
+        import aliyunSenseVoice
+        self.engine = aliyunSenseVoice
+        self.name = aliyunSenseVoice.BACKEND_NAME
+        self.model = aliyunSenseVoice.SENSEVOICE_MODEL
+
+    def has_cached_result(self, file_hash):
+        return os.path.exists(self.engine.get_transcript_path(file_hash))
+
+    def transcribe(self, audio_path, file_hash, cancel_event):
+        audio_oss_url = self.engine.upload_to_oss(audio_path, file_hash)
+        if not audio_oss_url or cancel_event.is_set():
+            return None
+
+        transcript_file = register_artifact(self.engine.transcribe_with_timestamps(audio_oss_url, file_hash, cancel_event), file_hash)
+        if not transcript_file or cancel_event.is_set():
+            return None
+
+        transcript_data = self.engine.parse_transcription_file(transcript_file)
+        if not transcript_data:
+            return None
+        return normalize_transcript(self.name, self.model, transcript_data['sentences'])
+
+class AzureBackend(TranscriptionBackend):
+    def __init__(self):
+        # Imported here so that routers without this backend don't load the Azure SDK
+        import azureWhisper
+        self.engine = azureWhisper
+        self.name = azureWhisper.BACKEND_NAME
+        self.model = azureWhisper.AZURE_SPEECH_MODEL
+
+    def has_cached_result(self, file_hash):
+        return os.path.exists(self.engine.get_transcript_path(file_hash))
+
+    def transcribe(self, audio_path, file_hash, cancel_event):
+        # Azure Speech reads WAV files only
+        wav_path = os.path.join('temp', f"original_{file_hash}.wav")
+        if not os.path.exists(wav_path):
+            cmd = ['ffmpeg', '-v', 'error', '-i', audio_path, '-ac', '1', '-ar', '16000', wav_path]
+            try:
+                subprocess.run(cmd, check=True)
+            except subprocess.CalledProcessError as e:
+                print(f"Error converting audio to WAV: {str(e)}")
+                return None
+        register_artifact(wav_path, file_hash)
+        if cancel_event.is_set():
+            return None
+
+        transcript_file = register_artifact(self.engine.transcribe_with_azure(wav_path, file_hash, cancel_event), file_hash)
+        if not transcript_file or cancel_event.is_set():
+            return None
+
+        transcript_data = self.engine.parse_transcription_file(transcript_file)
+        if not transcript_data:
+            return None
+        return normalize_transcript(self.name, self.model, transcript_data['sentences'])
+
+class WhisperBackend(TranscriptionBackend):
+    """Local Whisper model, no network or quota needed
+
+    A running Whisper transcription can't be interrupted, but it costs
+    nothing, so a cancelled run just finishes and is discarded.
+    """
+    name = 'whisper'
+    model = WHISPER_MODEL
+
+    _whisper_model = None
+    _load_lock = threading.Lock()
+
+    def transcribe(self, audio_path, file_hash, cancel_event):
+        # Imported lazily, loading torch and the model is slow and only needed when hedging to it
+        import whisper
+
+        with WhisperBackend._load_lock:
+            if WhisperBackend._whisper_model is None:
+                WhisperBackend._whisper_model = whisper.load_model(self.model)
+        if cancel_event.is_set():
+            return None
+
+        try:
+            result = WhisperBackend._whisper_model.transcribe(
+                audio_path,
+                language=os.getenv('TRANSCRIPTION_LANGUAGE', 'yue'),
+                fp16=False
+            )
+        except Exception as e:
+            print(f"Whisper transcription error: {str(e)}")
+            return None
+        return normalize_transcript(self.name, self.model, [
+            {
+                'start_time': segment['start'],
+                'end_time': segment['end'],
+                'text': segment['text']
+            }
+            for segment in result['segments']
+        ])
+
+BACKENDS = {
+    'sense_voice': SenseVoiceBackend,
+    'azure_speech': AzureBackend,
+    'whisper': WhisperBackend,
+}
+
+class LatencyHistogram:
+    """Histogram with geometrically growing buckets and decaying counts, used to pick hedging thresholds"""
+    def __init__(self, counts: Optional[List[float]] = None):
+        self.counts = counts if counts else [0.0] * HISTOGRAM_BUCKETS
+
+    @staticmethod
+    def bucket_bound(bucket: int) -> float:
+        return HISTOGRAM_MIN * HISTOGRAM_GROWTH ** bucket
+
+    @property
+    def total(self) -> float:
+        return sum(self.counts)
+
+    def record(self, value: float) -> None:
+        if value <= HISTOGRAM_MIN:
+            bucket = 0
+        else:
+            bucket = math.ceil(math.log(value / HISTOGRAM_MIN, HISTOGRAM_GROWTH))
+        self.counts = [count * HISTOGRAM_DECAY for count in self.counts]
+        self.counts[min(bucket, HISTOGRAM_BUCKETS - 1)] += 1
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Return the upper bound of the bucket holding the q-th quantile"""
+        total = self.total
+        if not total:
+            return None
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            seen += count
+            if seen >= q * total:
+                return self.bucket_bound(bucket)
+        return self.bucket_bound(HISTOGRAM_BUCKETS - 1)
+
+class TranscriptionRouter:
+    """Runs the primary backend and hedges to secondaries when it is slow or fails
+
+    The first successful transcript wins and the other backends are asked to
+    stop. Latencies are kept per backend, in a stats file shared by all worker
+    processes, and used to set the hedging threshold once enough samples exist.
+    """
+    def __init__(self, primary: TranscriptionBackend, secondaries: List[TranscriptionBackend],
+                 latency_ratio: float = DEFAULT_LATENCY_RATIO, latency_budget: float = DEFAULT_LATENCY_BUDGET,
+                 stats_file: Optional[str] = LATENCY_STATS_FILE):
+        self.primary = primary
+        self.secondaries = secondaries
+        self.latency_ratio = latency_ratio
+        self.latency_budget = latency_budget
+        self.stats_file = stats_file
+        self.lock = threading.Lock()
+        self.histograms: Dict[str, LatencyHistogram] = {}
+
+    @property
+    def backends(self) -> List[TranscriptionBackend]:
+        return [self.primary] + self.secondaries
+
+    @contextmanager
+    def _locked_stats(self, write: bool = False):
+        """Re-read the latency stats under a lock shared by all worker processes
+
+        With `write`, the stats are written back when the block ends, so
+        samples recorded by other workers in the meantime are kept.
+        """
+        with self.lock:
+            if not self.stats_file:
+                yield
+                return
+            os.makedirs(os.path.dirname(self.stats_file), exist_ok=True)
+            with open(f'{self.stats_file}.lock', 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX if write else fcntl.LOCK_SH)
+                try:
+                    if os.path.exists(self.stats_file):
+                        with open(self.stats_file, 'r', encoding='utf-8') as f:
+                            stats = json.load(f)
+                        self.histograms = {name: LatencyHistogram(counts) for name, counts in stats.items()}
+                    yield
+                    if write:
+                        self._save_stats()
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _save_stats(self) -> None:
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.stats_file), suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump({name: histogram.counts for name, histogram in self.histograms.items()}, f)
+        os.replace(tmp_path, self.stats_file)
+
+    def record_latency(self, backend: TranscriptionBackend, latency: float, audio_duration: Optional[float]) -> None:
+        """Record a call, as processing seconds per audio second"""
+        if not audio_duration:
+            return
+        with self._locked_stats(write=True):
+            self.histograms.setdefault(backend.name, LatencyHistogram()).record(latency / audio_duration)
+
+    def hedge_delay(self, backend: TranscriptionBackend, audio_duration: Optional[float]) -> float:
+        """Seconds to wait for `backend` before starting the next one"""
+        if not audio_duration:
+            return self.latency_budget
+        with self._locked_stats():
+            histogram = self.histograms.get(backend.name)
+            if histogram and histogram.total >= MIN_HEDGE_SAMPLES:
+                ratio = histogram.quantile(HEDGE_QUANTILE)
+            else:
+                ratio = self.latency_ratio
+        return max(MIN_HEDGE_DELAY, ratio * audio_duration)
+
+    def transcribe(self, audio_path: str, file_hash: str,
+                   audio_duration: Optional[float] = None) -> Optional[Tuple[TranscriptionBackend, Dict]]:
+        """Return the first successful (backend, transcript), or None if all backends fail"""
+        if audio_duration is None:
+            audio_duration = get_audio_duration(audio_path)
+        cancel_event = threading.Event()
+        results = queue.Queue()
+        waiting = list(self.backends)
+        # Running backends with their start time and whether they answer from a local file
+        running: Dict[str, Tuple[TranscriptionBackend, float, bool]] = {}
+
+        def run(backend):
+            try:
+                transcript = backend.transcribe(audio_path, file_hash, cancel_event)
+            except Exception as e:
+                print(f"Backend {backend.name} error: {str(e)}")
+                transcript = None
+            results.put((backend, transcript))
+
+        def launch():
+            backend = waiting.pop(0)
+            print(f"Starting transcription with backend: {backend.name}")
+            running[backend.name] = (backend, time.monotonic(), backend.has_cached_result(file_hash))
+            threading.Thread(target=run, args=(backend,), daemon=True).start()
+            return time.monotonic() + self.hedge_delay(backend, audio_duration)
+
+        hedge_at = launch()
+        while running:
+            timeout = max(0.0, hedge_at - time.monotonic()) if waiting else None
+            try:
+                backend, transcript = results.get(timeout=timeout)
+            except queue.Empty:
+                print("No result within the latency budget, hedging to the next backend")
+                hedge_at = launch()
+                continue
+
+            _, start_time, cached = running.pop(backend.name)
+            if transcript:
+                cancel_event.set()
+                now = time.monotonic()
+                latency = now - start_time
+                print(f"Backend {backend.name} won after {latency:.1f}s")
+                # Answers from a local file say nothing about the backend's speed
+                if not cached:
+                    self.record_latency(backend, latency, audio_duration)
+                # A loser's real latency is unknown, only that it is longer than its elapsed time.
+                # That lower bound is kept once it is past the loser's own hedge threshold;
+                # one cancelled soon after it started would drag its quantiles down.
+                for loser, loser_start_time, loser_cached in running.values():
+                    elapsed = now - loser_start_time
+                    if not loser_cached and elapsed >= self.hedge_delay(loser, audio_duration):
+                        self.record_latency(loser, elapsed, audio_duration)
+                return backend, transcript
+
+            # Fail over right away instead of waiting for the hedge timer
+            print(f"Backend {backend.name} failed")
+            if waiting:
+                hedge_at = launch()
+        return None
+
+def create_default_router() -> TranscriptionRouter:
+    """Build a router from TRANSCRIPTION_PRIMARY_BACKEND and TRANSCRIPTION_SECONDARY_BACKENDS"""
+    primary_name = os.getenv('TRANSCRIPTION_PRIMARY_BACKEND', 'sense_voice')
+    secondary_names = os.getenv('TRANSCRIPTION_SECONDARY_BACKENDS', 'azure_speech')
+    return TranscriptionRouter(
+        BACKENDS[primary_name](),
+        [BACKENDS[name.strip()]() for name in secondary_names.split(',') if name.strip()]
+    )
+
+def process_youtube_video(youtube_url: str, router: Optional[TranscriptionRouter] = None,
+                          output_prefix: str = 'output') -> Optional[str]:
+    """Process YouTube video, transcribing with whichever backend answers first"""
+    try:
+        router = router or create_default_router()
+
+        # Get hash once for consistent naming
+        file_hash = get_video_hash(youtube_url)
+
+        # Keep this job's files out of eviction while it runs
+        with pinned(file_hash):
+            # Make room for this job within the temp/ disk budget
+            forget_files(evict_to_budget())
+
+            # Reuse a transcript of the same video from any backend
+            transcription_file, transcript_offset = None, 0.0
+            for backend in router.backends:
+                cached = lookup_by_video(file_hash, backend.name, backend.cache_model)
+                if cached:
+                    transcription_file, transcript_offset = cached
+                    print(f"Using cached transcript for video: {transcription_file}")
+                    break
+            else:
+                # Download audio from YouTube
+                original_audio_path = register_artifact(download_youtube_audio(youtube_url, file_hash), file_hash)
+                if not original_audio_path:
+                    raise Exception("Failed to download audio")
+
+                # Reuse a transcript of the same audio content (re-uploads, mirrors)
+                audio_fingerprint = get_audio_fingerprint(original_audio_path)
+                winner = None
+                if audio_fingerprint is not None:
+                    cached = lookup_by_audio(audio_fingerprint, [(backend.name, backend.cache_model) for backend in router.backends])
+                    if cached:
+                        backend_name, transcription_file, transcript_offset = cached
+                        winner = next(backend for backend in router.backends if backend.name == backend_name)
+                        print(f"Using cached transcript for audio: {transcription_file}")
+
+                if not winner:
+                    result = router.transcribe(original_audio_path, file_hash)
+                    if not result:
+                        raise Exception("All transcription backends failed")
+                    winner, transcript = result
+
+                    # Save the normalized transcript
+                    transcription_file = os.path.join('temp', f'{file_hash}_transcript_{winner.name}_{winner.model}.json')
+                    with open(transcription_file, 'w', encoding='utf-8') as f:
+                        json.dump(transcript, f, ensure_ascii=False, indent=2)
+                register_artifact(store_transcript(file_hash, audio_fingerprint, winner.name, winner.cache_model, transcription_file, transcript_offset), file_hash)
+            register_artifact(transcription_file, file_hash)
+
+            # Download video with audio
+            original_video_path = register_artifact(download_youtube_video(youtube_url, file_hash), file_hash)
+            if not original_video_path:
+                raise Exception("Failed to download video")
+
+            transcript_data = load_transcript(transcription_file)
+            if not transcript_data:
+                raise Exception("Failed to read transcript")
+
+            # Line the cached transcript up with this video's audio
+            transcript_data['sentences'] = shift_sentences(transcript_data['sentences'], transcript_offset)
+
+            # Create SRT file using hash
+            srt_content = create_srt_from_transcript(transcript_data)
+            srt_path = os.path.join('temp', f'{file_hash}.srt')
+            with open(srt_path, 'w', encoding='utf-8') as f:
+                f.write(srt_content)
+
+            # Embed subtitles into video using file hash
+            output_video = embed_subtitles(original_video_path, srt_path, file_hash, output_prefix)
+            if not output_video:
+                raise Exception("Failed to embed subtitles")
+            register_artifact(output_video, file_hash)
+
+            # Clean up temporary files
+            if os.path.exists(srt_path):
+                os.remove(srt_path)
+
+            print(f"Video with subtitles saved as: {output_video}")
+            print(f"Transcript saved as: {transcription_file}")
+            return output_video
+
+    except Exception as e:
+        print(f"Error processing video: {str(e)}")
+        return None
+
+if __name__ == "__main__":
+    youtube_url = "https://youtu.be/l2JAsuVG_8c"  # Replace with your YouTube URL
+    output_video = process_youtube_video(youtube_url)
+    print('output video: ', output_video)
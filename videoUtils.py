@@ -0,0 +1,104 @@
+import os
+import subprocess
+from typing import Optional, Dict
+
+import yt_dlp
+
+def download_youtube_audio(youtube_url: str, file_hash: str, codec: str = 'm4a') -> Optional[str]:
+    """Download audio from YouTube video, converted to `codec`"""
+    output_path = os.path.join('temp', f"original_{file_hash}.{codec}")
+
+    # Check if file already exists
+    if os.path.exists(output_path):
+        print(f"Audio file already exists: {output_path}")
+        return output_path
+
+    ydl_opts = {
+        'format': 'm4a/bestaudio/best',
+        'postprocessors': [{
+            'key': 'FFmpegExtractAudio',
+            'preferredcodec': codec,
+        }],
+        'outtmpl': os.path.splitext(output_path)[0],
+        'nocheckcertificate': True,  # Skip SSL certificate verification
+    }
+
+    try:
+        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            ydl.download([youtube_url])
+        return output_path
+    except Exception as e:
+        print(f"Error downloading audio: {str(e)}")
+        return None
+
+def download_youtube_video(youtube_url: str, file_hash: str) -> Optional[str]:
+    """Download video with audio from YouTube"""
+    output_template = os.path.join('temp', f"original_{file_hash}.%(ext)s")
+
+    # Try to find existing video file
+    for ext in ['mp4', 'mkv', 'webm']:
+        existing_file = os.path.join('temp', f"original_{file_hash}.{ext}")
+        if os.path.exists(existing_file):
+            print(f"Video file already exists: {existing_file}")
+            return existing_file
+
+    ydl_opts = {
+        'format': 'best',
+        'outtmpl': output_template,
+        'nocheckcertificate': True,
+    }
+    try:
+        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            info = ydl.extract_info(youtube_url, download=True)
+            video_path = ydl.prepare_filename(info)
+        return video_path
+    except Exception as e:
+        print(f"Error downloading video: {str(e)}")
+        return None
+
+def create_srt_from_transcript(transcript_data: Dict) -> str:
+    """Convert transcript data (sentence times in seconds) to SRT format"""
+    srt_content = []
+    counter = 1
+
+    for sentence in transcript_data.get('sentences', []):
+        start_time = float(sentence.get('start_time', 0))
+        end_time = float(sentence.get('end_time', 0))
+        text = sentence.get('text', '')
+
+        # Convert seconds to SRT time format (HH:MM:SS,mmm)
+        start_formatted = f"{int(start_time//3600):02d}:{int((start_time%3600)//60):02d}:{int(start_time%60):02d},{int((start_time*1000)%1000):03d}"
+        end_formatted = f"{int(end_time//3600):02d}:{int((end_time%3600)//60):02d}:{int(end_time%60):02d},{int((end_time*1000)%1000):03d}"
+
+        srt_entry = f"{counter}\n{start_formatted} --> {end_formatted}\n{text}\n\n"
+        srt_content.append(srt_entry)
+        counter += 1
+
+    return ''.join(srt_content)
+
+def embed_subtitles(source_video_path: str, srt_path: str, file_hash: str, output_prefix: str = 'output') -> Optional[str]:
+    """Embed SRT subtitles into video file"""
+    try:
+        # Get the extension from the original video
+        video_ext = os.path.splitext(source_video_path)[1]
+        # Determine output path using file hash and original video extension
+        output_video = os.path.join('temp', f'{output_prefix}_{file_hash}{video_ext}')
+
+        # Check if output file already exists
+        if os.path.exists(output_video):
+            print(f"Video with subtitles already exists: {output_video}")
+            return output_video
+
+        print(f"Embedding subtitles into video: {output_video}")
+        cmd = [
+            'ffmpeg', '-i', source_video_path,
+            '-i', srt_path,
+            '-c', 'copy',
+            '-c:s', 'mov_text',
+            output_video
+        ]
+        subprocess.run(cmd, check=True)
+        return output_video
+    except subprocess.CalledProcessError as e:
+        print(f"Error embedding subtitles: {str(e)}")
+        return None